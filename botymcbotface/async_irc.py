@@ -7,6 +7,17 @@ import select
 import socket
 import time
 
+from botymcbotface import batch
+from botymcbotface.async_scheduler import AsyncScheduler
+from botymcbotface.capabilities import (CapNegotiator, ServerInfoCache,
+                                        ends_negotiation, parse_cap_line)
+from botymcbotface.ctcp import CTCPResponder, parse_ctcp
+from botymcbotface.flood import InboundThrottle
+from botymcbotface.isupport import ServerInfo, parse_isupport_line
+from botymcbotface.lag import Keepalive
+from botymcbotface.plugins import PluginLoader
+from botymcbotface.sendqueue import SendQueue
+
 
 class IRCBot:
     """
@@ -17,11 +28,74 @@ class IRCBot:
         self.password = password
         self.debug_level = debug_level
         self.version = version
+        self.ctcp = CTCPResponder(version)
+
+        # Inbound flood protection. Set to None to disable.
+        self.throttle = InboundThrottle()
+
+        # What the server has told us about itself, in 005 and CAP
+        # lines. Replaced (never changed) as we learn more, so it's safe
+        # to hold on to. server_cache remembers it for each server, so
+        # that reconnects don't have to wait for it; give it a path to
+        # keep it between runs.
+        self.server_info = ServerInfo()
+        self.server_cache = ServerInfoCache()
+        self.caps = CapNegotiator()
+
+        self.scheduler = AsyncScheduler(on_error=self.on_job_error)
+
+        # Client-initiated PINGs, for measuring lag and detecting dead
+        # connections. Set to None to disable.
+        self.keepalive = Keepalive()
+        self.keepalive_job = None
+
+        # Everything we send goes through this queue, and is written by
+        # flush_loop(), so that a server which is slow to read only
+        # holds up that task, not the whole bot.
+        self.send_queue = SendQueue(on_overload=self.on_send_overload,
+                                    on_resume=self.on_send_resume)
+        self.send_ready = asyncio.Event()
+        self.flush_task = None
+
+        # See load_plugins().
+        self.plugins = None
+
+        # The caches of handlers decorated with cache.cached_command(),
+        # by name.
+        self.response_caches = {}
+
+        self.server = None
+        self.channel = None
+
+        # The channels we're on, casefolded, from the server's JOIN,
+        # PART and KICK lines. See update_joined().
+        self.joined_channels = set()
+
+        # Set when the connection is lost; get_msg() reconnects. See
+        # reconnect() for reconnect_delay.
+        self.disconnected = False
+        self.connected_at = 0
+        self.reconnect_delay = 0
 
     async def connect(self, server, channel):
         """
         Connect to the specified IRC server.
         """
+        self.server = server
+        self.channel = channel
+
+        if self.keepalive:
+            self.keepalive.reset()
+
+        cached = self.server_cache.get(server)
+
+        if cached:
+            # The capabilities have to be enabled again for this
+            # connection; until the server ACKs them, they aren't.
+            cached = cached.with_caps(cached.available_caps, ())
+
+        self.server_info = cached or ServerInfo()
+
         connected = False
         skip_seconds = 10
         self.debug_print("Connecting to: " + server, 1)
@@ -40,9 +114,26 @@ class IRCBot:
                     skip_seconds = 600
 
         self.debug_print("Connected.", 1)
+        self.disconnected = False
+        self.connected_at = time.monotonic()
+
+        if self.flush_task:
+            self.flush_task.cancel()
+
+        self.send_queue.clear()
+        self.joined_channels.clear()
+        self.flush_task = asyncio.create_task(self.flush_loop())
+
+        # With what we know about this server from earlier, the
+        # capability negotiation doesn't have to wait for the server.
+        for line in self.caps.start(cached):
+            await self.send(line)
         await self.send(f"USER {self.nickname} 0 * :Experimental bot.")
-        await self.get_line(2)
         await self.send(f"NICK {self.nickname}")
+        if self.caps.pipelined:
+            for line in self.caps.end():
+                await self.send(line)
+        await self.negotiate_caps()
         await self.get_line(2)
         await self.send(f"PRIVMSG NickServ :IDENTIFY {self.nickname} "
                         f"{self.password}")
@@ -50,6 +141,88 @@ class IRCBot:
         await self.send(f"JOIN {channel}")
         await self.get_line(2)
 
+        if self.keepalive:
+            self.keepalive_job = self.call_later(self.keepalive.interval,
+                                                 self.keepalive_tick)
+
+    async def reconnect(self):
+        """
+        Drop the current connection, and connect to the same server
+        and channel again. If the server keeps dropping us, wait longer
+        and longer between attempts, like connect() does: 10 seconds at
+        first, doubling up to 10 minutes.
+        """
+        if time.monotonic() - self.connected_at >= 600:
+            # The last connection lasted for a while, so the server
+            # isn't dropping us right away.
+            self.reconnect_delay = 0
+
+        while True:
+            if self.reconnect_delay:
+                self.debug_print(f"Reconnecting in {self.reconnect_delay} "
+                                 f"seconds.", 1)
+                await asyncio.sleep(self.reconnect_delay)
+
+            self.reconnect_delay = min(max(self.reconnect_delay * 2, 10),
+                                       600)
+            self.debug_print("Reconnecting.", 1)
+
+            if self.keepalive_job:
+                self.keepalive_job.cancel()
+
+            self.writer.close()
+            await self.connect(self.server, self.channel)
+
+            if not self.disconnected:
+                return
+
+    async def keepalive_tick(self):
+        """
+        Timer job which sends our own PINGs. See lag.Keepalive.
+        """
+        token, delay = self.keepalive.tick()
+
+        if self.keepalive.dead:
+            # Closing the connection wakes up get_line() with an EOF,
+            # and get_msg() reconnects.
+            self.debug_print("No PONG from server.", 1)
+            self.disconnected = True
+            self.writer.close()
+            return
+
+        if token:
+            await self.send(f"PING :{token}")
+
+        self.keepalive_job = self.call_later(delay, self.keepalive_tick)
+
+    def update_server_info(self, info):
+        """
+        Replace the ServerInfo snapshot, and remember it for the next
+        time we connect to this server.
+        """
+        self.server_info = info
+
+        if self.server:
+            self.server_cache.put(self.server, info)
+
+    async def negotiate_caps(self, timeout=10):
+        """
+        Read lines from the server until the capability negotiation is
+        over, or until the server says it doesn't support it. If it
+        doesn't say, give up after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+
+        while not self.caps.done and not self.disconnected:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                for line in self.caps.end():
+                    await self.send(line)
+                break
+
+            await self.get_line(remaining)
+
     def debug_print(self, text, level):
         """
         Print a debugging message, but only when in debug mode.
@@ -62,16 +235,148 @@ class IRCBot:
         if self.debug_level >= level:
             print("IRC[%d] %s%s" % (level, "   " * (level - 1), text))
 
-    async def send(self, msg):
+    async def send(self, msg, priority=None):
+        """
+        Low level function which sends a message to the server. The
+        message is put in the send queue (see sendqueue.SendQueue), and
+        written by flush_loop() as soon as the flood limit and the
+        server allow. It never waits for the server.
+
+        Returns: False if the message was rejected because the send
+        queue is overloaded, otherwise True.
+        """
+        msg = msg.rstrip()
+        self.debug_print(f"-> {msg!r}", 1)
+        return self.enqueue((msg + "\r\n").encode(), priority)
+
+    async def send_raw(self, data, priority=None):
+        """
+        Low level function which sends an already encoded line,
+        including the trailing CRLF, to the server. See send().
+        """
+        self.debug_print(f"-> {data!r}", 1)
+        return self.enqueue(data, priority)
+
+    def enqueue(self, data, priority):
+        if not self.send_queue.put(data, priority):
+            self.debug_print(f"Send queue overloaded, rejected: {data!r}", 2)
+            return False
+
+        self.send_ready.set()
+        return True
+
+    async def flush_loop(self):
+        """
+        Task which writes lines from the send queue to the server, as
+        fast as the flood limit allows. If the server's write buffer is
+        full, only this task waits.
+        """
+        queue = self.send_queue
+
+        while True:
+            if self.keepalive:
+                queue.slow = self.keepalive.lagging
+
+            data = queue.pop()
+
+            if data is None:
+                self.send_ready.clear()
+                try:
+                    await asyncio.wait_for(self.send_ready.wait(),
+                                           queue.delay())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+            except ConnectionError:
+                # Closing the connection wakes up get_line(), and
+                # get_msg() reconnects.
+                self.debug_print("Connection lost while sending.", 1)
+                self.disconnected = True
+                self.writer.close()
+                return
+
+    def load_plugins(self, directory=None, reload_interval=2, group=None):
+        """
+        Find plugins in directory, and among installed packages' entry
+        points in group, if specified (see plugins.PluginLoader).
+        Channel and private messages starting with "!" and one of the
+        plugins' commands are routed to the plugin by route_msg(),
+        instead of to on_channel_msg() or on_private_msg(). Plugins are
+        imported the first time they are used, and imported again when
+        their source changes, without disconnecting. Plugin handle()
+        functions may be coroutine functions.
+        Must be called from within the event loop.
+
+        Returns: the PluginLoader.
+        """
+        self.plugins = PluginLoader(directory, group)
+
+        for name, error in self.plugins.discover():
+            self.debug_print(f"Failed to load plugin {name}: {error}", 0)
+
+        self.debug_print(f"Found {len(self.plugins.commands)} plugin commands "
+                         f"in {self.plugins.discover_time:.3f} seconds.", 1)
+
+        if reload_interval:
+            self.call_every(reload_interval, self.reload_plugins)
+
+        return self.plugins
+
+    def reload_plugins(self):
+        """
+        Import plugins whose source has changed again.
+        """
+        for name, error in self.plugins.check_reload():
+            self.debug_print(f"Failed to reload plugin {name}: {error}", 0)
+
+    async def dispatch_plugin(self, msg, found):
+        """
+        Hand msg to the plugin whose command it is; found is what
+        self.plugins.find(msg) returned. If the plugin can't be
+        imported, or its handler raises an exception, the error is
+        reported with debug_print(), and the message is dropped.
+        """
+        plugin, command, args = found
+
+        try:
+            result = plugin.handle(self, msg, command, args)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            self.debug_print(f"Plugin {plugin.name} failed on {command}: "
+                             f"{e!r}", 0)
+
+    def call_later(self, delay, func, *args):
+        """
+        Call func(*args) once, in delay seconds. The job is run by the
+        event loop; if func is a coroutine function, it is run as a
+        task. If it raises an exception, on_job_error() is called. Must
+        be called from within the event loop.
+
+        Returns: a Job object, which can be cancel()led.
         """
-        Low level function which sends a message to the socket.
+        return self.scheduler.call_later(delay, func, *args)
+
+    def call_every(self, interval, func, *args):
         """
-        msg = msg.rstrip() + "\r\n"
+        Call func(*args) every interval seconds.
 
-        # If the write buffer is full, we have to wait before we can write more.
-        await self.writer.drain()
-        self.writer.write(msg.encode())
-        self.debug_print(f"-> {msg.rstrip()!r}", 1)
+        Returns: a Job object, which can be cancel()led.
+        """
+        return self.scheduler.call_every(interval, func, *args)
+
+    def call_cron(self, spec, func, *args):
+        """
+        Call func(*args) at the times given by a cron-like spec, such
+        as "*/15 8-17 * * 1-5".
+
+        Returns: a Job object, which can be cancel()led.
+        """
+        return self.scheduler.call_cron(spec, func, *args)
 
     async def privmsg(self, channel, msg):
         """
@@ -92,12 +397,65 @@ class IRCBot:
         """
         await self.send("JOIN " + channel)
 
+    async def join_channels(self, channels, keys=None):
+        """
+        Have the bot join several channels, with as few JOIN lines as
+        possible. keys is an optional dict of channel keys. Channels
+        beyond the server's CHANLIMIT, counting the ones we're already
+        on, are skipped.
+        """
+        channels, dropped = batch.limit_channels(
+            channels, self.server_info.chanlimit, self.joined_channels,
+            self.server_info.casefold)
+
+        if dropped:
+            self.debug_print(f"CHANLIMIT reached, not joining: "
+                             f"{', '.join(dropped)}", 1)
+
+        info = self.server_info
+
+        for line in batch.join_lines(channels, keys,
+                                     info.max_targets("JOIN", None),
+                                     info.linelen - 2):
+            await self.send(line)
+
+    async def set_modes(self, channel, mode, params):
+        """
+        Set or unset a mode which takes a parameter for several users
+        (or other parameters) at once, for example:
+        set_modes("#channel", "+o", ["alice", "bob", "carol"]). As many
+        as the server's MODES allows are packed into each line.
+        """
+        info = self.server_info
+
+        for line in batch.mode_lines(channel, mode, params, info.max_modes,
+                                     info.linelen - 2):
+            await self.send(line)
+
+    async def kick_many(self, channel, users, reason=None):
+        """
+        Kick several users from channel, with as many per line as the
+        server's TARGMAX allows. Only works if the bot is an operator.
+        """
+        info = self.server_info
+
+        for line in batch.kick_lines(channel, users, reason,
+                                     info.max_targets("KICK"),
+                                     info.linelen - 2):
+            await self.send(line)
+
     async def get_line(self, timeout=10):
         """
         Low level function which reads one line from the server.
         If the timeout is reached, None is returned instead. get_msg() is a
         higher level function which returns a parsed output.
+
+        If the connection is lost, None is returned, and
+        self.disconnected is set until get_msg() has reconnected.
         """
+        if self.disconnected:
+            return None
+
         #line = await self.reader.readline()
         future = self.reader.readline()
 
@@ -105,6 +463,15 @@ class IRCBot:
             line = await asyncio.wait_for(future, timeout=timeout)
         except asyncio.TimeoutError:
             return None
+        except ConnectionError:
+            line = b""
+
+        if not line:
+            # The server closed the connection, or we did because it
+            # stopped answering our PINGs.
+            self.debug_print("Connection closed.", 1)
+            self.disconnected = True
+            return None
 
         line = line.decode().strip()
 
@@ -117,31 +484,93 @@ class IRCBot:
             await self.send("PONG " + line.split()[1] + "\r\n")
             return None
 
+        if self.keepalive and " PONG " in line:
+            fields = line.split(" ", 3)
+            if fields[1] == "PONG" and \
+                    self.keepalive.pong(fields[-1].lstrip(":")) is not None:
+                return None
+
+        if " CAP " in line:
+            cap = parse_cap_line(line)
+            if cap is not None:
+                for reply in self.caps.handle(*cap):
+                    await self.send(reply)
+                self.update_server_info(self.server_info.with_caps(
+                    self.caps.available, self.caps.enabled))
+                return None
+
+        if not self.caps.done and ends_negotiation(line):
+            self.caps.stop()
+
+        if " 005 " in line:
+            tokens = parse_isupport_line(line)
+            if tokens is not None:
+                self.update_server_info(self.server_info.with_isupport(tokens))
+
+        if " JOIN " in line or " PART " in line or " KICK " in line:
+            self.update_joined(line)
+
         return line
 
+    def update_joined(self, line):
+        """
+        Keep track of which channels we're on, from a JOIN, PART or KICK
+        line which concerns us.
+        """
+        fields = line.split(" ", 4)
+
+        if len(fields) < 3 or not fields[0].startswith(":"):
+            return
+
+        casefold = self.server_info.casefold
+        nick = casefold(fields[0][1:].split("!", 1)[0])
+        channel = casefold(fields[2].lstrip(":"))
+        own_nick = casefold(self.nickname)
+
+        if fields[1] == "JOIN" and nick == own_nick:
+            self.joined_channels.add(channel)
+        elif fields[1] == "PART" and nick == own_nick:
+            self.joined_channels.discard(channel)
+        elif fields[1] == "KICK" and len(fields) > 3 and \
+                casefold(fields[3]) == own_nick:
+            self.joined_channels.discard(channel)
+
     async def get_msg(self, timeout=10):
         """
         Higher level function than get_line(). get_msg() returns a
-        IRCMsg object.
+        IRCMsg object. CTCP queries (except ACTION) are answered here,
+        and are not returned. Neither are lines dropped by the inbound
+        flood protection (see self.throttle).
+
+        If the connection has been lost, get_msg() reconnects first.
 
         Returns: IRCMsg object
         """
+        if self.disconnected:
+            await self.reconnect()
 
         line = await self.get_line(timeout)
 
+        if line and self.throttle and not self.throttle.allow_line(line):
+            self.debug_print("Throttled.", 2)
+            return None
+
         irc_msg = self.parse_irc_msg(line)
 
         if not irc_msg:
             return None
 
-        if (irc_msg.channel == self.nickname and
-            irc_msg.msg_text == "\x01VERSION\x01"):
-            await self.privmsg(irc_msg.sender, self.version)
+        if (irc_msg.ctcp_command and irc_msg.ctcp_command != "ACTION" and
+                irc_msg.msg_type == "PRIVMSG"):
+            reply = self.ctcp.reply(irc_msg.sender, irc_msg.ctcp_command,
+                                    irc_msg.ctcp_args)
+            if reply:
+                await self.send_raw(reply)
             return None
 
         return irc_msg
 
-    def route_msg(self, timeout=10):
+    async def route_msg(self, timeout=10):
         """
         Even higher level function than get_msg(). route_msg() reads a
         message (if one arrives within the timeout, in seconds), and
@@ -151,13 +580,14 @@ class IRCBot:
         which start with "on_", can be overridden by an application
         which inherits this class. That application then calls
         route_msg(), and as a result, its own on_* functions will be
-        called.
+        called. The on_* functions may be coroutines, in which case
+        they are awaited.
 
         Returns: IRCMsg object if a message was routed within the
         timeout, otherwise None.
         """
 
-        msg = self.get_msg(timeout)
+        msg = await self.get_msg(timeout)
 
         if not msg:
             return None
@@ -166,23 +596,37 @@ class IRCBot:
         msg_type = msg.msg_type
         channel = msg.channel
         # msg_text = msg.msg_text
+        found = None
+
+        if msg_type == "PRIVMSG" and self.plugins:
+            found = self.plugins.find(msg)
 
         if msg_type == "JOIN":
-            self.on_join_msg(msg)
+            result = self.on_join_msg(msg)
 
         elif msg_type == "PART":
-            self.on_part_msg(msg)
+            result = self.on_part_msg(msg)
+
+        elif found:
+            result = self.dispatch_plugin(msg, found)
+
+        elif msg_type == "PRIVMSG" and msg.ctcp_command == "ACTION":
+            result = self.on_action_msg(msg)
 
         elif msg_type == "PRIVMSG" and \
-                channel.lower() == self.nickname.lower():
-            self.on_private_msg(msg)
+                self.server_info.casefold(channel) == \
+                self.server_info.casefold(self.nickname):
+            result = self.on_private_msg(msg)
 
         elif msg_type == "PRIVMSG":
-            self.on_channel_msg(msg)
+            result = self.on_channel_msg(msg)
 
         else:
             return None
 
+        if asyncio.iscoroutine(result):
+            await result
+
         return msg
 
     def parse_irc_msg(self, line):
@@ -224,7 +668,43 @@ class IRCBot:
         if msg_text:
             self.debug_print(f"MSG_TEXT:  {msg_text!r}", 2)
 
-        return IRCMsg(sender, msg_type, channel, msg_text)
+        irc_msg = IRCMsg(sender, msg_type, channel, msg_text)
+
+        ctcp = parse_ctcp(msg_text)
+
+        if ctcp:
+            irc_msg.ctcp_command, irc_msg.ctcp_args = ctcp
+            self.debug_print(f"CTCP:      {irc_msg.ctcp_command!r}", 2)
+
+        return irc_msg
+
+    def on_job_error(self, job, error):
+        """
+        Called when a job scheduled with call_later(), call_every() or
+        call_cron() raises an exception. Repeating jobs keep repeating.
+        This method is meant to be overridden.
+        """
+        name = getattr(job.func, "__name__", job.func)
+        self.debug_print(f"on_job_error(): {name} failed: {error!r}", 0)
+
+    def on_send_overload(self):
+        """
+        Called when the send queue has grown past its high water mark,
+        because the server isn't reading fast enough, or because we're
+        sending more than the flood limit allows. Until on_send_resume()
+        is called, it's a good idea to avoid sending things which can
+        wait. self.send_queue.overloaded can also be checked.
+        This method is meant to be overridden.
+        """
+        self.debug_print("on_send_overload(): Send queue overloaded.", 1)
+
+    def on_send_resume(self):
+        """
+        Called when the send queue is back down to its low water mark
+        after on_send_overload().
+        This method is meant to be overridden.
+        """
+        self.debug_print("on_send_resume(): Send queue resumed.", 1)
 
     def on_channel_msg(self, msg):
         """
@@ -240,6 +720,15 @@ class IRCBot:
         """
         self.debug_print("on_private_msg(): Unimplemented.", 2)
 
+    def on_action_msg(self, msg):
+        """
+        Called by route_msg() if the message is a CTCP ACTION (/me),
+        either on a channel or in private. The action text is in
+        msg.ctcp_args.
+        This method is meant to be overridden.
+        """
+        self.debug_print("on_action_msg(): Unimplemented.", 2)
+
     def on_join_msg(self, msg):
         """
         Called by route_msg() if the message is a join message (that
@@ -266,6 +755,8 @@ class IRCMsg:
         self.msg_type = msg_type
         self.channel = channel
         self.msg_text = msg_text
+        self.ctcp_command = None
+        self.ctcp_args = None
 
     def __repr__(self):
         return "IRC message from %s of type %s on channel %s with " \
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import functools
+import time
+
+from botymcbotface.scheduler import CronSpec, Job
+
+
+class AsyncScheduler:
+    """
+    Timers for the asyncio IRCBot. The same interface as Scheduler, but
+    the jobs are handed to the event loop's own timers. A job which is
+    a coroutine function is run as a task. If a job raises an exception
+    (or its task does), on_error(job, exception) is called, if given;
+    otherwise it's left to the event loop's exception handler.
+    """
+    def __init__(self, wall_clock=time.time, on_error=None):
+        self.wall_clock = wall_clock
+        self.on_error = on_error
+        self.tasks = set()
+
+    def schedule(self, job, when):
+        loop = asyncio.get_running_loop()
+        job.when = when
+        job.handle = loop.call_at(when, self.run_job, loop, job)
+        return job
+
+    def run_job(self, loop, job):
+        if job.cancelled:
+            return
+
+        when = job.next_when(loop.time, self.wall_clock)
+
+        if when is not None:
+            self.schedule(job, when)
+
+        try:
+            result = job.func(*job.args)
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            self.on_error(job, e)
+            return
+
+        if asyncio.iscoroutine(result):
+            # Keep a reference, or the task may be garbage collected
+            # before it's done.
+            task = loop.create_task(result)
+            self.tasks.add(task)
+            task.add_done_callback(functools.partial(self.task_done, job))
+
+    def task_done(self, job, task):
+        self.tasks.discard(task)
+
+        if self.on_error is None or task.cancelled():
+            return
+
+        error = task.exception()
+
+        if isinstance(error, Exception):
+            self.on_error(job, error)
+
+    def call_at(self, when, func, *args):
+        return self.schedule(Job(func, args), when)
+
+    def call_later(self, delay, func, *args):
+        return self.call_at(asyncio.get_running_loop().time() + delay,
+                            func, *args)
+
+    def call_every(self, interval, func, *args):
+        return self.schedule(Job(func, args, interval=interval),
+                             asyncio.get_running_loop().time() + interval)
+
+    def call_cron(self, spec, func, *args):
+        loop = asyncio.get_running_loop()
+        job = Job(func, args, cron=CronSpec(spec))
+        job.when = loop.time()
+        return self.schedule(job, job.next_when(loop.time, self.wall_clock))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# The longest line we may send, in bytes, not counting the CRLF, unless
+# the server announces a LINELEN.
+MAX_LINE = 510
+
+
+def pack(build, items, max_items=None, max_line=MAX_LINE):
+    """
+    Split items into as few lines as possible. build(chunk) makes the
+    line for a list of items; each line gets at most max_items items
+    (None means no limit), and is at most max_line bytes long.
+
+    Returns: a list of lines.
+    """
+    lines = []
+    chunk = []
+
+    for item in items:
+        if chunk and ((max_items and len(chunk) >= max_items) or
+                      len(build(chunk + [item]).encode()) > max_line):
+            lines.append(build(chunk))
+            chunk = []
+        chunk.append(item)
+
+    if chunk:
+        lines.append(build(chunk))
+
+    return lines
+
+
+def limit_channels(channels, chanlimit, joined=(), casefold=str.lower):
+    """
+    Drop the channels beyond what chanlimit(chantype) (see
+    ServerInfo.chanlimit()) allows for each channel type. joined is the
+    channels we're already on, as casefold() gives them; they count
+    toward the limit, and joining them again doesn't.
+
+    Returns: a (kept, dropped) tuple of lists.
+    """
+    counts = {}
+    kept = []
+    dropped = []
+
+    for channel in joined:
+        counts[channel[:1]] = counts.get(channel[:1], 0) + 1
+
+    for channel in channels:
+        chantype = channel[:1]
+        limit = chanlimit(chantype)
+        count = counts.get(chantype, 0)
+
+        if casefold(channel) in joined:
+            kept.append(channel)
+        elif limit is not None and count >= limit:
+            dropped.append(channel)
+        else:
+            counts[chantype] = count + 1
+            kept.append(channel)
+
+    return kept, dropped
+
+
+def join_lines(channels, keys=None, max_targets=None, max_line=MAX_LINE):
+    """
+    JOIN lines for channels. keys is an optional dict of channel keys;
+    channels with keys go first, since the keys are matched to the
+    channels by position.
+    """
+    keys = keys or {}
+    pairs = sorted(((channel, keys.get(channel)) for channel in channels),
+                   key=lambda pair: pair[1] is None)
+
+    def build(chunk):
+        line = "JOIN " + ",".join(channel for channel, key in chunk)
+        chunk_keys = [key for channel, key in chunk if key is not None]
+
+        if chunk_keys:
+            line += " " + ",".join(chunk_keys)
+
+        return line
+
+    return pack(build, pairs, max_targets, max_line)
+
+
+def mode_lines(channel, mode, params, max_modes=None, max_line=MAX_LINE):
+    """
+    MODE lines setting or unsetting a mode which takes a parameter,
+    such as "+o", for each of params: "MODE #c +ooo a b c".
+    """
+    if len(mode) != 2 or mode[0] not in "+-":
+        raise ValueError("Mode should be like '+o', not %r" % mode)
+
+    def build(chunk):
+        return "MODE %s %s%s %s" % (channel, mode[0], mode[1] * len(chunk),
+                                    " ".join(chunk))
+
+    return pack(build, params, max_modes, max_line)
+
+
+def kick_lines(channel, users, reason=None, max_targets=1,
+               max_line=MAX_LINE):
+    """
+    KICK lines for users: "KICK #c a,b,c :reason".
+    """
+    def build(chunk):
+        line = "KICK %s %s" % (channel, ",".join(chunk))
+
+        if reason:
+            line += " :" + reason
+
+        return line
+
+    return pack(build, users, max_targets, max_line)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import collections
+import functools
+import time
+
+# Returned by ResponseCache.get() on a miss, since None is a valid
+# value to look up.
+MISSING = object()
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache where every entry also expires `ttl`
+    seconds after it was stored. Keeps hit/miss counts, see stats().
+    in_flight holds the futures of values which are being computed (see
+    cached_command()).
+    """
+    def __init__(self, ttl=300, maxsize=256, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        """
+        Look up key.
+
+        Returns: the cached value, or MISSING.
+        """
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            expires, value = entry
+            if expires > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+
+        self.misses += 1
+        return MISSING
+
+    def put(self, key, value):
+        """
+        Store value under key, evicting the least recently used entry
+        if the cache is full.
+        """
+        self.entries[key] = (self.clock() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Returns: a dict with the cache's counters.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def command_key(msg, per_channel=False):
+    """
+    Build a cache key from an IRCMsg: the command in lower case and its
+    arguments with the whitespace collapsed, plus the channel if
+    per_channel is set.
+    """
+    words = (msg.msg_text or "").split()
+
+    if words:
+        words[0] = words[0].lower()
+
+    key = " ".join(words)
+
+    if per_channel:
+        return (msg.channel.lower() if msg.channel else None, key)
+
+    return key
+
+
+def cached_command(ttl=300, maxsize=256, per_channel=False, key=None):
+    """
+    Decorator for deterministic command handlers, that is, methods which
+    take an IRCMsg and return the reply text. The reply is cached by
+    command and arguments (see command_key()), or by key(msg) if
+    specified. Replies of None are not cached.
+
+    Works on both plain methods and coroutines. For coroutines, identical
+    requests which arrive while the first one is still being computed
+    wait for its result instead of computing it again; they count as
+    "coalesced" in the stats, not as misses. If the first one is
+    cancelled, one of them computes the result instead.
+
+    Each bot has its own caches, in its response_caches dict, by the
+    handler's qualified name. The wrapper's cache_for(bot) returns the
+    one for bot:
+
+        class MyBot(IRCBot):
+            @cached_command(ttl=600)
+            def help_text(self, msg):
+                ...
+
+            def on_channel_msg(self, msg):
+                if msg.msg_text.startswith("!help"):
+                    self.privmsg(msg.channel, self.help_text(msg))
+
+        MyBot.help_text.cache_for(bot).stats()
+
+    The handler may also be a plain function which takes the bot as its
+    first argument.
+    """
+    if key is None:
+        key = functools.partial(command_key, per_channel=per_channel)
+
+    def decorator(func):
+        name = func.__qualname__
+
+        def cache_for(bot):
+            caches = getattr(bot, "response_caches", None)
+
+            if caches is None:
+                caches = bot.response_caches = {}
+
+            cache = caches.get(name)
+
+            if cache is None:
+                cache = caches[name] = ResponseCache(ttl, maxsize)
+
+            return cache
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(self, msg, *args, **kwargs):
+                cache = cache_for(self)
+                in_flight = cache.in_flight
+                cache_key = key(msg)
+
+                while True:
+                    future = in_flight.get(cache_key)
+
+                    if future is None:
+                        break
+
+                    cache.coalesced += 1
+                    value = await asyncio.shield(future)
+
+                    if value is not MISSING:
+                        return value
+
+                    # The request we were waiting for was cancelled, so
+                    # compute the value ourselves, unless someone else
+                    # already does.
+
+                value = cache.get(cache_key)
+
+                if value is not MISSING:
+                    return value
+
+                future = asyncio.get_running_loop().create_future()
+                in_flight[cache_key] = future
+
+                try:
+                    value = await func(self, msg, *args, **kwargs)
+                except Exception as e:
+                    future.set_exception(e)
+                    # Mark the exception as retrieved, in case nobody
+                    # else was waiting for it.
+                    future.exception()
+                    raise
+                except BaseException:
+                    # Cancelled. Don't cancel the ones waiting for us;
+                    # let them try again.
+                    future.set_result(MISSING)
+                    raise
+                finally:
+                    del in_flight[cache_key]
+
+                if value is not None:
+                    cache.put(cache_key, value)
+
+                future.set_result(value)
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(self, msg, *args, **kwargs):
+                cache = cache_for(self)
+                cache_key = key(msg)
+                value = cache.get(cache_key)
+
+                if value is not MISSING:
+                    return value
+
+                value = func(self, msg, *args, **kwargs)
+
+                if value is not None:
+                    cache.put(cache_key, value)
+
+                return value
+
+        wrapper.cache_for = cache_for
+        return wrapper
+
+    return decorator
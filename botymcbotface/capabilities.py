@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import json
+import os
+
+from botymcbotface.isupport import ServerInfo
+
+# Capabilities we ask for if the server has them. Only ones which don't
+# change the format of the lines we get, since parse_irc_msg() doesn't
+# handle message tags.
+DEFAULT_CAPS = ("multi-prefix", "cap-notify", "away-notify")
+
+
+def parse_caps(text):
+    """
+    Parse a list of capabilities, such as "sasl=PLAIN multi-prefix",
+    into a dict of name -> value.
+    """
+    caps = {}
+
+    for cap in text.split():
+        name, _, value = cap.partition("=")
+        caps[name] = value
+
+    return caps
+
+
+def parse_cap_line(line):
+    """
+    Returns: a (subcommand, more, caps) tuple for a CAP line from the
+    server, or None if line isn't one. more is True if this is not the
+    last line of a multi-line LS or LIST reply.
+    """
+    fields = line.split(" ", 4)
+
+    if len(fields) < 4 or fields[1] != "CAP":
+        return None
+
+    # ":server CAP nick SUBCOMMAND [*] :caps"
+    subcommand = fields[3]
+    rest = fields[4] if len(fields) == 5 else ""
+
+    more = rest.startswith("* ")
+
+    if more:
+        rest = rest[2:]
+
+    return subcommand.upper(), more, rest.lstrip(":")
+
+
+def ends_negotiation(line):
+    """
+    Returns: True if line means that the server isn't waiting for CAP
+    END: RPL_WELCOME (001), or ERR_UNKNOWNCOMMAND (421) for CAP from a
+    server which doesn't support capability negotiation.
+    """
+    fields = line.split(" ", 4)
+
+    if len(fields) < 3:
+        return False
+
+    return fields[1] == "001" or \
+        (fields[1] == "421" and len(fields) > 3 and fields[3].upper() == "CAP")
+
+
+class CapNegotiator:
+    """
+    IRCv3 capability negotiation. start() gives the lines to send
+    before NICK and USER, and handle() the lines to send in response to
+    each CAP line from the server. The negotiation is over when end()
+    has been sent, or when stop() is called because the server isn't
+    waiting for it ("done").
+
+    With a cached ServerInfo from an earlier connection, start() asks
+    for the capabilities right away ("pipelined"), and the bot sends
+    end() right after NICK and USER, without waiting for the server's
+    LS and ACK. Their answers still update the capabilities as they
+    arrive.
+    """
+    def __init__(self, wanted=DEFAULT_CAPS):
+        self.wanted = set(wanted)
+        self.reset()
+
+    def reset(self):
+        self.available = {}
+        self.enabled = set()
+        self.ls_more = False
+        self.done = False
+        self.pipelined = False
+
+    def start(self, cached=None):
+        """
+        Returns: a list of lines to send.
+        """
+        self.reset()
+
+        if cached is None or not cached.available_caps:
+            return ["CAP LS 302"]
+
+        self.pipelined = True
+        request = sorted(self.wanted & set(cached.available_caps))
+        lines = ["CAP LS 302"]
+
+        if request:
+            lines.append("CAP REQ :" + " ".join(request))
+
+        return lines
+
+    def end(self):
+        """
+        Returns: the lines which end the negotiation, if it hasn't
+        ended yet.
+        """
+        if self.done:
+            return []
+
+        self.done = True
+
+        return ["CAP END"]
+
+    def stop(self):
+        """
+        End the negotiation without sending anything, see
+        ends_negotiation().
+        """
+        self.done = True
+
+    def handle(self, subcommand, more, caps):
+        """
+        Returns: a list of lines to send in response.
+        """
+        if subcommand == "LS":
+            if not self.ls_more:
+                self.available = {}
+            self.available.update(parse_caps(caps))
+            self.ls_more = more
+
+            if more or self.pipelined or self.done:
+                return []
+
+            request = sorted(self.wanted & set(self.available))
+
+            if request:
+                return ["CAP REQ :" + " ".join(request)]
+
+            return self.end()
+
+        if subcommand == "ACK":
+            for cap in caps.split():
+                if cap.startswith("-"):
+                    self.enabled.discard(cap[1:])
+                else:
+                    self.enabled.add(cap)
+
+            return [] if self.pipelined else self.end()
+
+        if subcommand == "NAK":
+            return [] if self.pipelined else self.end()
+
+        if subcommand == "NEW":
+            new = parse_caps(caps)
+            self.available.update(new)
+            request = sorted(self.wanted & set(new) - self.enabled)
+
+            if request:
+                return ["CAP REQ :" + " ".join(request)]
+
+        elif subcommand == "DEL":
+            for cap in caps.split():
+                self.available.pop(cap, None)
+                self.enabled.discard(cap)
+
+        return []
+
+
+class ServerInfoCache:
+    """
+    Remembers the ServerInfo of each server we've been connected to, so
+    that a reconnect doesn't have to wait for it. If path is specified,
+    it's also kept in that JSON file, and survives restarts.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.servers = {}
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.servers = {server: ServerInfo.from_dict(data)
+                                for server, data in json.load(f).items()}
+
+    def get(self, server):
+        return self.servers.get(server.lower())
+
+    def put(self, server, info):
+        server = server.lower()
+
+        if self.servers.get(server) == info:
+            return
+
+        self.servers[server] = info
+
+        if self.path:
+            # Write to a temporary file first, so that a crash can't
+            # leave a half-written cache behind.
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({server: info.to_dict()
+                           for server, info in self.servers.items()},
+                          f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
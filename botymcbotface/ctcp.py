@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import time
+
+from botymcbotface.ratelimit import KeyedRateLimiter
+
+# CTCP messages are PRIVMSGs (queries) or NOTICEs (replies) whose text
+# is wrapped in this character.
+CTCP_DELIM = "\x01"
+
+CTCP_COMMANDS = ("ACTION", "CLIENTINFO", "PING", "TIME", "VERSION")
+
+
+def parse_ctcp(text):
+    """
+    Split a CTCP message into its command and arguments.
+
+    Returns: a (command, args) tuple, or None if text isn't CTCP.
+    """
+    if not text or text[0] != CTCP_DELIM:
+        return None
+
+    body = text[1:]
+
+    if body.endswith(CTCP_DELIM):
+        body = body[:-1]
+
+    command, _, args = body.partition(" ")
+
+    return command.upper(), args
+
+
+class CTCPResponder:
+    """
+    Answers CTCP queries with NOTICEs. The replies which never change
+    (VERSION and CLIENTINFO) are encoded once, up front. Every sender
+    has its own rate limit, and there's a global cap on top of that, so
+    a CTCP flood from many clients can't eat our outbound budget.
+    """
+    def __init__(self, version, sender_burst=2, sender_rate=0.1,
+                 global_burst=5, global_rate=0.5, clock=time.monotonic):
+        self.limiter = KeyedRateLimiter(sender_burst, sender_rate,
+                                        global_burst, global_rate,
+                                        clock=clock)
+        self.static_replies = {
+            "VERSION": self.encode_payload("VERSION " + version),
+            "CLIENTINFO": self.encode_payload("CLIENTINFO " +
+                                              " ".join(CTCP_COMMANDS)),
+        }
+
+    @staticmethod
+    def encode_payload(text):
+        return (CTCP_DELIM + text + CTCP_DELIM + "\r\n").encode()
+
+    def reply(self, sender, command, args):
+        """
+        Build the reply to a CTCP query from sender.
+
+        Returns: the complete, encoded NOTICE line, or None if the
+        query shouldn't be answered (unknown command, or rate limited).
+        """
+        payload = self.static_replies.get(command)
+
+        if payload is None and command not in ("PING", "TIME"):
+            return None
+
+        if not self.limiter.allow(sender.lower()):
+            return None
+
+        if command == "PING":
+            payload = self.encode_payload("PING " + args)
+        elif command == "TIME":
+            payload = self.encode_payload("TIME " + time.ctime())
+
+        return b"NOTICE " + sender.encode() + b" :" + payload
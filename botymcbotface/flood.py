@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import collections
+import time
+
+from botymcbotface.ratelimit import SlidingWindowCounter
+
+# Only these message types cause work in the on_* handlers, so they're
+# the only ones we count and drop. JOIN, PART etc always get through.
+THROTTLED_TYPES = ("PRIVMSG", "NOTICE")
+
+
+class InboundThrottle:
+    """
+    Inbound flood protection. Counts PRIVMSGs and NOTICEs per nick, and
+    commands (messages starting with one of `command_prefixes`) per
+    channel, over a sliding window. A nick which goes over its limit is
+    ignored for `cooldown` seconds; a channel which goes over its limit
+    has its commands dropped for `cooldown` seconds. Ordinary chat in a
+    busy channel only counts against each nick.
+
+    allow_line() works on the raw line, so lines are dropped by looking
+    at the prefix and the message type alone, before the line is parsed.
+    At most `max_ignored` nicks and channels are ignored at a time; when
+    there are more, the oldest ignores are lifted.
+    """
+    def __init__(self, nick_limit=8, nick_window=10,
+                 channel_limit=30, channel_window=10,
+                 cooldown=60, max_ignored=4096, command_prefixes=("!",),
+                 clock=time.monotonic):
+        self.nick_limit = nick_limit
+        self.channel_limit = channel_limit
+        self.command_prefixes = tuple(command_prefixes)
+        self.cooldown = cooldown
+        self.clock = clock
+        self.nick_counter = SlidingWindowCounter(nick_window, clock=clock)
+        self.channel_counter = SlidingWindowCounter(channel_window,
+                                                    clock=clock)
+        self.ignored = collections.OrderedDict()
+        self.max_ignored = max_ignored
+        self.dropped = 0
+
+    def ignore(self, name, seconds=None):
+        """
+        Drop everything from a nick, or all commands on a channel, for
+        the specified number of seconds. Defaults to the cooldown.
+        """
+        if seconds is None:
+            seconds = self.cooldown
+
+        self.start_cooldown(name.lower(), self.clock(), seconds)
+
+    def unignore(self, name):
+        """
+        Stop ignoring a nick or channel.
+        """
+        self.ignored.pop(name.lower(), None)
+
+    def start_cooldown(self, name, now, seconds):
+        self.ignored.pop(name, None)
+
+        while len(self.ignored) >= self.max_ignored:
+            self.ignored.popitem(last=False)
+
+        self.ignored[name] = now + seconds
+
+    def is_ignored(self, name, now):
+        until = self.ignored.get(name)
+
+        if until is None:
+            return False
+
+        if until <= now:
+            del self.ignored[name]
+            return False
+
+        return True
+
+    def allow_line(self, line):
+        """
+        Decide if a raw line from the server should be processed.
+
+        Returns: False if the line should be dropped, otherwise True.
+        """
+        if not line or line[0] != ":":
+            # No prefix, so it's from the server itself.
+            return True
+
+        end = line.find(" ")
+        bang = line.find("!", 1, end)
+
+        if bang < 0:
+            # A server prefix, not a nick.
+            return True
+
+        fields = line.split(" ", 3)
+
+        if len(fields) < 3 or fields[1] not in THROTTLED_TYPES:
+            return True
+
+        now = self.clock()
+        nick = line[1:bang].lower()
+
+        if self.ignored and self.is_ignored(nick, now):
+            self.dropped += 1
+            return False
+
+        channel = fields[2].lower()
+
+        if channel[:1] in ("#", "&") and len(fields) == 4 and \
+                fields[3].lstrip(":").startswith(self.command_prefixes):
+            if self.ignored and self.is_ignored(channel, now):
+                self.dropped += 1
+                return False
+
+            if self.channel_counter.hit(channel, now) > self.channel_limit:
+                self.start_cooldown(channel, now, self.cooldown)
+                self.dropped += 1
+                return False
+
+        if self.nick_counter.hit(nick, now) > self.nick_limit:
+            self.start_cooldown(nick, now, self.cooldown)
+            self.dropped += 1
+            return False
+
+        return True
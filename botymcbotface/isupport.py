@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Used when the server doesn't announce MODES (RFC 2812 says 3).
+DEFAULT_MODES = 3
+
+# Used when the server doesn't announce LINELEN. Includes the CRLF.
+DEFAULT_LINELEN = 512
+
+CASEMAPPINGS = {
+    "ascii": str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                           "abcdefghijklmnopqrstuvwxyz"),
+    "rfc1459": str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\^",
+                             "abcdefghijklmnopqrstuvwxyz{}|~"),
+    "strict-rfc1459": str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\",
+                                    "abcdefghijklmnopqrstuvwxyz{}|"),
+}
+
+
+def parse_isupport_line(line):
+    """
+    Returns: the tokens of an RPL_ISUPPORT (005) line, or None if line
+    isn't one.
+    """
+    fields = line.split(" ")
+
+    if len(fields) < 4 or fields[1] != "005":
+        return None
+
+    tokens = []
+
+    # Skip the prefix, the numeric and our own nick, and stop at the
+    # trailing ":are supported by this server".
+    for field in fields[3:]:
+        if field.startswith(":"):
+            break
+        if field:
+            tokens.append(field)
+
+    return tokens
+
+
+def parse_limits(value, separator):
+    """
+    Parse "A:1,B:,C:3" style values (TARGMAX, CHANLIMIT) into a dict.
+    An empty limit means no limit, and becomes None.
+    """
+    limits = {}
+
+    for pair in value.split(","):
+        name, _, limit = pair.partition(separator)
+        if name:
+            limits[name.upper()] = int(limit) if limit else None
+
+    return limits
+
+
+def optional_int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class ServerInfo:
+    """
+    An immutable snapshot of what the server has told us about itself:
+    its RPL_ISUPPORT (005) tokens and its IRCv3 capabilities. The
+    values other code needs are worked out once, when the snapshot is
+    made, so looking them up is cheap. When the server tells us more,
+    the bot replaces its snapshot with a new one (see with_isupport()
+    and with_caps()). The dicts in it must not be changed either.
+    """
+    __slots__ = ("tokens", "available_caps", "enabled_caps", "network",
+                 "casemapping", "chantypes", "max_modes", "linelen",
+                 "nicklen", "targmax", "chanlimits")
+
+    def __init__(self, tokens=None, available_caps=None, enabled_caps=()):
+        tokens = dict(tokens or {})
+
+        if "MODES" not in tokens:
+            max_modes = DEFAULT_MODES
+        else:
+            max_modes = optional_int(tokens["MODES"])
+
+        chanlimits = {}
+
+        for prefixes, limit in parse_limits(tokens.get("CHANLIMIT", ""),
+                                            ":").items():
+            for prefix in prefixes:
+                chanlimits[prefix] = limit
+
+        values = {
+            "tokens": tokens,
+            "available_caps": dict(available_caps or {}),
+            "enabled_caps": frozenset(enabled_caps),
+            "network": tokens.get("NETWORK") or None,
+            "casemapping": (tokens.get("CASEMAPPING") or "rfc1459").lower(),
+            "chantypes": tokens.get("CHANTYPES", "#&"),
+            "max_modes": max_modes,
+            "linelen": optional_int(tokens.get("LINELEN"), DEFAULT_LINELEN),
+            "nicklen": optional_int(tokens.get("NICKLEN")),
+            "targmax": parse_limits(tokens.get("TARGMAX", ""), ":"),
+            "chanlimits": chanlimits,
+        }
+
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ServerInfo is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ServerInfo is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, ServerInfo):
+            return NotImplemented
+
+        # Everything else is worked out from these.
+        return (self.tokens == other.tokens and
+                self.available_caps == other.available_caps and
+                self.enabled_caps == other.enabled_caps)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "ServerInfo(%r, %r, %r)" % (self.tokens, self.available_caps,
+                                           sorted(self.enabled_caps))
+
+    def with_isupport(self, new_tokens):
+        """
+        Returns: a new snapshot, with the tokens from a 005 line added.
+        "-NAME" removes a token.
+        """
+        tokens = dict(self.tokens)
+
+        for token in new_tokens:
+            if token.startswith("-"):
+                tokens.pop(token[1:].upper(), None)
+            else:
+                name, _, value = token.partition("=")
+                tokens[name.upper()] = value
+
+        return ServerInfo(tokens, self.available_caps, self.enabled_caps)
+
+    def with_caps(self, available_caps, enabled_caps):
+        """
+        Returns: a new snapshot, with the specified capabilities.
+        """
+        return ServerInfo(self.tokens, available_caps, enabled_caps)
+
+    def has_cap(self, name):
+        """
+        True if the capability has been enabled for our connection.
+        """
+        return name in self.enabled_caps
+
+    def max_targets(self, command, default=1):
+        """
+        The number of targets command accepts, from TARGMAX, or None if
+        there is no limit. If the server doesn't say, default.
+        """
+        return self.targmax.get(command.upper(), default)
+
+    def chanlimit(self, chantype):
+        """
+        The number of channels of type chantype (such as "#") we may be
+        on, from CHANLIMIT, or None if there is no limit.
+        """
+        return self.chanlimits.get(chantype)
+
+    def is_channel(self, name):
+        return bool(name) and name[0] in self.chantypes
+
+    def casefold(self, name):
+        """
+        Returns: name in lower case, by the server's CASEMAPPING, so that
+        nicks and channels can be compared.
+        """
+        return name.translate(CASEMAPPINGS.get(self.casemapping,
+                                               CASEMAPPINGS["rfc1459"]))
+
+    def to_dict(self):
+        return {
+            "tokens": dict(self.tokens),
+            "available_caps": dict(self.available_caps),
+            "enabled_caps": sorted(self.enabled_caps),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("tokens"), data.get("available_caps"),
+                   data.get("enabled_caps", ()))
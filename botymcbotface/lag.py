@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import collections
+import time
+
+
+class LagMeter:
+    """
+    Keeps the most recent round-trip times to the server, and an
+    exponentially weighted moving average of them.
+    """
+    def __init__(self, samples=64, alpha=0.25):
+        self.samples = collections.deque(maxlen=samples)
+        self.alpha = alpha
+        self.average = None
+
+    def add(self, rtt):
+        self.samples.append(rtt)
+
+        if self.average is None:
+            self.average = rtt
+        else:
+            self.average += self.alpha * (rtt - self.average)
+
+    def percentile(self, percent):
+        """
+        Returns: the given percentile (0-100) of the kept samples, or
+        None if there are none.
+        """
+        if not self.samples:
+            return None
+
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+
+        return ordered[index]
+
+    def stats(self):
+        return {
+            "last": self.samples[-1] if self.samples else None,
+            "average": self.average,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "samples": len(self.samples),
+        }
+
+
+class Keepalive:
+    """
+    Client-initiated PINGs. The bot calls tick() on a timer, sends a
+    PING with the token it returns, and passes the tokens of PONGs it
+    receives to pong(). A PING which isn't answered within `timeout`
+    seconds counts as missed, and is followed by another one right
+    away; after `max_missed` in a row the connection is considered dead
+    and the bot should reconnect.
+    """
+    def __init__(self, interval=60, timeout=10, max_missed=3,
+                 lag_threshold=5.0, clock=time.monotonic):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_missed = max_missed
+        self.lag_threshold = lag_threshold
+        self.clock = clock
+        self.meter = LagMeter()
+        self.sequence = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the state of the previous connection. The lag samples
+        are kept.
+        """
+        self.pending = None
+        self.sent = None
+        self.missed = 0
+
+    @property
+    def dead(self):
+        return self.missed >= self.max_missed
+
+    @property
+    def lagging(self):
+        """
+        True if the average lag, or the age of an unanswered PING, is
+        above lag_threshold. Outbound traffic should slow down.
+        """
+        if self.pending is not None and \
+                self.clock() - self.sent > self.lag_threshold:
+            return True
+
+        return self.meter.average is not None and \
+            self.meter.average > self.lag_threshold
+
+    def tick(self):
+        """
+        Called by the bot's keepalive timer.
+
+        Returns: a (token, delay) tuple. If token isn't None, a PING
+        with it should be sent. The timer should fire again in delay
+        seconds. If the connection is dead, (None, None) is returned.
+        """
+        now = self.clock()
+
+        if self.pending is not None:
+            # No PONG within the timeout.
+            self.missed += 1
+            self.pending = None
+            if self.dead:
+                return None, None
+        elif self.sent is not None and now - self.sent < self.interval:
+            return None, self.interval - (now - self.sent)
+
+        self.sequence += 1
+        self.pending = "bmb%d" % self.sequence
+        self.sent = now
+
+        return self.pending, self.timeout
+
+    def pong(self, token):
+        """
+        Called by the bot when a PONG arrives.
+
+        Returns: the round-trip time, or None if the PONG wasn't an
+        answer to our outstanding PING.
+        """
+        if token != self.pending:
+            return None
+
+        rtt = self.clock() - self.sent
+        self.meter.add(rtt)
+        self.pending = None
+        self.missed = 0
+
+        return rtt
+
+    def stats(self):
+        stats = self.meter.stats()
+        stats["missed"] = self.missed
+        stats["lagging"] = self.lagging
+
+        return stats
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import ast
+import importlib
+import importlib.util
+import os
+import sys
+import time
+
+ENTRY_POINT_GROUP = "botymcbotface.plugins"
+
+
+def read_commands(path):
+    """
+    Find a plugin's commands without importing it, by looking for a
+    literal "COMMANDS = [...]" at the top level of its source.
+
+    Returns: a list of command names.
+    """
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), path)
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and \
+                any(isinstance(target, ast.Name) and target.id == "COMMANDS"
+                    for target in node.targets):
+            return [command.lower()
+                    for command in ast.literal_eval(node.value)]
+
+    return []
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class Plugin:
+    """
+    A plugin is a module with a list of command names in COMMANDS, and a
+    function handle(bot, msg, command, args). The module is imported the
+    first time one of its commands is used.
+    """
+    def __init__(self, name, path=None, entry_point=None, commands=()):
+        self.name = name
+        self.path = path
+        self.entry_point = entry_point
+        self.commands = list(commands)
+        self.module = None
+        self.mtime = None
+        self.load_time = None
+
+    def source_mtime(self):
+        path = self.path
+
+        if path is None and self.module is not None:
+            path = getattr(self.module, "__file__", None)
+
+        if path is None:
+            return None
+
+        return file_mtime(path)
+
+    def load(self):
+        """
+        Import the plugin, or import it again if it's already loaded. If
+        that fails, the exception is raised and the previously loaded
+        version, if any, is kept.
+        """
+        start = time.perf_counter()
+
+        if self.path:
+            module_name = "botymcbotface_plugin_" + self.name
+            spec = importlib.util.spec_from_file_location(module_name,
+                                                          self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            sys.modules[module_name] = module
+        elif self.module is not None:
+            module = importlib.reload(self.module)
+        else:
+            module = self.entry_point.load()
+
+        self.module = module
+        self.mtime = self.source_mtime()
+        self.load_time = time.perf_counter() - start
+        self.commands = [command.lower()
+                         for command in getattr(module, "COMMANDS",
+                                                self.commands)]
+
+    def handle(self, bot, msg, command, args):
+        if self.module is None:
+            self.load()
+
+        return self.module.handle(bot, msg, command, args)
+
+
+class PluginLoader:
+    """
+    Finds plugins in a directory (one .py file each) and/or among the
+    installed packages' entry points, without importing them. find()
+    gives the plugin for a message starting with prefix + command, and
+    its handle() imports it if needed. check_reload() imports changed
+    plugins again, in-process.
+
+    Entry points are only looked for if group is given, usually as
+    ENTRY_POINT_GROUP; that costs some startup time, since
+    importlib.metadata is slow to import and to search. For entry
+    points, the name is the command and the value is the plugin module,
+    e.g. in setup.py:
+
+        entry_points={"botymcbotface.plugins": ["weather = mybot.weather"]}
+    """
+    def __init__(self, directory=None, group=None, prefix="!"):
+        self.directory = directory
+        self.group = group
+        self.prefix = prefix
+        self.plugins = {}
+        self.commands = {}
+        # The mtimes of plugin files whose commands couldn't be read.
+        self.failed = {}
+        self.discover_time = None
+
+    def discover(self):
+        """
+        Find all plugins, and which commands they have.
+
+        Returns: a list of (plugin name, exception) for plugin files
+        whose commands couldn't be read. Those are skipped, until they
+        change (see check_reload()).
+        """
+        start = time.perf_counter()
+        errors = []
+
+        if self.directory:
+            for filename in sorted(os.listdir(self.directory)):
+                if filename.endswith(".py") and not filename.startswith("_"):
+                    error = self.try_add_file(filename)
+                    if error is not None:
+                        errors.append((filename[:-3], error))
+
+        if self.group:
+            # Only imported when needed; it's slow to import.
+            import importlib.metadata
+
+            for entry_point in importlib.metadata.entry_points(
+                    group=self.group):
+                plugin = self.plugins.get(entry_point.value)
+                if plugin is None:
+                    plugin = Plugin(entry_point.value,
+                                    entry_point=entry_point)
+                    self.plugins[entry_point.value] = plugin
+                plugin.commands.append(entry_point.name.lower())
+
+        self.update_commands()
+        self.discover_time = time.perf_counter() - start
+
+        return errors
+
+    def add_file(self, filename):
+        path = os.path.join(self.directory, filename)
+        plugin = Plugin(filename[:-3], path=path,
+                        commands=read_commands(path))
+        plugin.mtime = plugin.source_mtime()
+        self.plugins[path] = plugin
+
+    def try_add_file(self, filename):
+        """
+        add_file(), unless the file has failed before and hasn't changed
+        since.
+
+        Returns: the exception if the file couldn't be added, otherwise
+        None.
+        """
+        path = os.path.join(self.directory, filename)
+        mtime = file_mtime(path)
+
+        if path in self.failed and self.failed[path] == mtime:
+            return None
+
+        try:
+            self.add_file(filename)
+        except Exception as e:
+            self.failed[path] = mtime
+            return e
+
+        self.failed.pop(path, None)
+        return None
+
+    def update_commands(self):
+        self.commands = {command: plugin
+                         for plugin in self.plugins.values()
+                         for command in plugin.commands}
+
+    def find(self, msg):
+        """
+        Returns: the (plugin, command, args) which msg should be
+        dispatched to, or None if it isn't a plugin command.
+        """
+        text = msg.msg_text
+
+        if not text or not text.startswith(self.prefix):
+            return None
+
+        command, _, args = text[len(self.prefix):].partition(" ")
+        plugin = self.commands.get(command.lower())
+
+        if plugin is None:
+            return None
+
+        return plugin, command.lower(), args.strip()
+
+    def check_reload(self):
+        """
+        Import loaded plugins whose source has changed again, re-read
+        the commands of the ones which aren't loaded yet, and pick up
+        new and removed plugin files.
+
+        Returns: a list of (plugin name, exception) for plugins which
+        failed to reload. Those keep running their previous version.
+        """
+        errors = []
+
+        if self.directory:
+            paths = set()
+
+            for filename in os.listdir(self.directory):
+                if filename.endswith(".py") and not filename.startswith("_"):
+                    path = os.path.join(self.directory, filename)
+                    paths.add(path)
+                    if path not in self.plugins:
+                        error = self.try_add_file(filename)
+                        if error is not None:
+                            errors.append((filename[:-3], error))
+
+            for path in [path for path, plugin in self.plugins.items()
+                         if plugin.path and path not in paths]:
+                del self.plugins[path]
+
+            for path in [path for path in self.failed if path not in paths]:
+                del self.failed[path]
+
+        for plugin in self.plugins.values():
+            mtime = plugin.source_mtime()
+
+            if mtime is None or mtime == plugin.mtime:
+                continue
+
+            try:
+                if plugin.module is not None:
+                    plugin.load()
+                else:
+                    plugin.commands = read_commands(plugin.path)
+                    plugin.mtime = mtime
+            except Exception as e:
+                # Don't try again until the file changes again.
+                plugin.mtime = mtime
+                errors.append((plugin.name, e))
+
+        self.update_commands()
+
+        return errors
+
+    def stats(self):
+        """
+        Returns: a dict with the discovery time, and the import time of
+        each loaded plugin, in seconds.
+        """
+        return {
+            "discover_time": self.discover_time,
+            "load_times": {plugin.name: plugin.load_time
+                           for plugin in self.plugins.values()
+                           if plugin.module is not None},
+        }
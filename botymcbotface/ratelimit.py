@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import collections
+import time
+
+
+class TokenBucket:
+    """
+    A classic token bucket. Allows bursts of up to `capacity` events,
+    refilled at `rate` tokens per second.
+    """
+    __slots__ = ("capacity", "rate", "tokens", "stamp")
+
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.stamp = now
+
+    def consume(self, now, amount=1):
+        """
+        Try to take `amount` tokens from the bucket.
+
+        Returns: True if there were enough tokens, otherwise False.
+        """
+        elapsed = now - self.stamp
+
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.stamp = now
+
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+
+        return False
+
+    def delay(self, now, amount=1):
+        """
+        Returns: the number of seconds until `amount` tokens are
+        available.
+        """
+        tokens = min(self.capacity,
+                     self.tokens + max(0, now - self.stamp) * self.rate)
+
+        if tokens >= amount:
+            return 0
+
+        return (amount - tokens) / self.rate
+
+    def is_full(self, now):
+        """
+        Returns: True if the bucket would be full at time `now`, which
+        means it carries no state worth keeping.
+        """
+        return self.tokens + (now - self.stamp) * self.rate >= self.capacity
+
+
+class KeyedRateLimiter:
+    """
+    One token bucket per key (typically a nick), plus one global bucket
+    which caps the total no matter how many keys are involved. The
+    buckets are kept in least recently used order; when there are
+    `max_keys` of them, the least recently used one is forgotten to make
+    room for a new key, so memory use is bounded. A forgotten bucket
+    starts out full again, but the global bucket still applies.
+    """
+    def __init__(self, burst, rate, global_burst, global_rate,
+                 max_keys=1024, clock=time.monotonic):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets = collections.OrderedDict()
+        self.global_bucket = TokenBucket(global_burst, global_rate, clock())
+
+    def allow(self, key):
+        """
+        Account for one event from `key`.
+
+        Returns: True if the event is within both the per-key and the
+        global limit, otherwise False.
+        """
+        now = self.clock()
+        bucket = self.buckets.get(key)
+
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+            bucket = TokenBucket(self.burst, self.rate, now)
+            self.buckets[key] = bucket
+        else:
+            self.buckets.move_to_end(key)
+
+        if not bucket.consume(now):
+            return False
+
+        return self.global_bucket.consume(now)
+
+    def expire(self, now=None):
+        """
+        Forget all buckets which have refilled.
+        """
+        if now is None:
+            now = self.clock()
+
+        for key in [key for key, bucket in self.buckets.items()
+                    if bucket.is_full(now)]:
+            del self.buckets[key]
+
+
+class SlidingWindowCounter:
+    """
+    Counts events per key over a sliding window of `window` seconds.
+    Each key costs three numbers: the start of the current fixed window,
+    and the counts for the current and the previous window. The sliding
+    count is estimated by weighting the previous window by how much of
+    it still overlaps. Keys which have been quiet for two windows are
+    expired, and when there are `max_keys` keys, the least recently used
+    one is forgotten to make room for a new one.
+    """
+    def __init__(self, window, max_keys=4096, clock=time.monotonic):
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        self.counters = collections.OrderedDict()
+        self.next_sweep = clock() + window * 2
+
+    def hit(self, key, now=None):
+        """
+        Count one event for key.
+
+        Returns: the estimated number of events for key within the last
+        window, including this one.
+        """
+        if now is None:
+            now = self.clock()
+
+        if now >= self.next_sweep:
+            self.expire(now)
+
+        counter = self.counters.get(key)
+
+        if counter is None:
+            if len(self.counters) >= self.max_keys:
+                self.counters.popitem(last=False)
+            counter = [now, 0, 0]
+            self.counters[key] = counter
+        else:
+            self.counters.move_to_end(key)
+            elapsed = now - counter[0]
+            if elapsed >= self.window * 2:
+                counter[0], counter[1], counter[2] = now, 0, 0
+            elif elapsed >= self.window:
+                counter[0] += self.window
+                counter[1], counter[2] = counter[2], 0
+
+        counter[2] += 1
+        overlap = 1 - (now - counter[0]) / self.window
+
+        return counter[1] * overlap + counter[2]
+
+    def expire(self, now=None):
+        """
+        Forget keys which have had no events for two windows.
+        """
+        if now is None:
+            now = self.clock()
+
+        horizon = now - self.window * 2
+
+        # The least recently used keys come first, so stop at the first
+        # one which is still active. The few quiet keys behind it are
+        # caught by a later sweep.
+        while self.counters:
+            key, counter = next(iter(self.counters.items()))
+            if counter[0] > horizon:
+                break
+            del self.counters[key]
+
+        self.next_sweep = now + self.window * 2
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import datetime
+import heapq
+import itertools
+import time
+
+
+class CronSpec:
+    """
+    A cron-like schedule: "minute hour day-of-month month day-of-week",
+    where each field is "*", a number, a range "a-b", a step "*/n" or
+    "a-b/n", or a comma separated list of those. Day of week 0 is
+    Sunday. As in cron, if both day fields are restricted, a time
+    matching either of them matches.
+    """
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, spec):
+        fields = spec.split()
+
+        if len(fields) != 5:
+            raise ValueError("Cron spec needs 5 fields: %r" % spec)
+
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [self.parse_field(field, low, high)
+                           for field, (low, high) in zip(fields,
+                                                         self.FIELDS)]
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def parse_field(field, low, high):
+        values = set()
+
+        for part in field.split(","):
+            step = 1
+
+            if "/" in part:
+                part, step = part.split("/")
+                step = int(step)
+
+            if part == "*":
+                first, last = low, high
+            elif "-" in part:
+                first, last = (int(value) for value in part.split("-"))
+            else:
+                first = last = int(part)
+
+            if first < low or last > high or first > last or step < 1:
+                raise ValueError("Invalid cron field: %r" % field)
+
+            values.update(range(first, last + 1, step))
+
+        return frozenset(values)
+
+    def day_matches(self, dt):
+        weekday = (dt.weekday() + 1) % 7
+
+        if self.any_day:
+            return self.any_weekday or weekday in self.weekdays
+
+        if self.any_weekday:
+            return dt.day in self.days
+
+        return dt.day in self.days or weekday in self.weekdays
+
+    def next_after(self, timestamp):
+        """
+        Returns: the first time (as a Unix timestamp) after timestamp
+        which matches this spec.
+        """
+        dt = datetime.datetime.fromtimestamp(timestamp).replace(
+            second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        give_up = dt.year + 5
+
+        while dt.year <= give_up:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) +
+                      datetime.timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + \
+                    datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+
+        raise ValueError("Cron spec never matches.")
+
+
+class Job:
+    """
+    A scheduled call. Returned by the call_* methods; call cancel() to
+    stop it from running (again).
+    """
+    def __init__(self, func, args, interval=None, cron=None):
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.cron = cron
+        self.when = None
+        self.cancelled = False
+        self.handle = None
+
+    def cancel(self):
+        self.cancelled = True
+
+        if self.handle:
+            self.handle.cancel()
+
+    def next_when(self, clock, wall_clock):
+        """
+        Returns: when a periodic job should run next, on the scheduler's
+        clock, or None if the job doesn't repeat.
+        """
+        if self.interval is not None:
+            # Based on the previous deadline rather than on "now", so
+            # that the job doesn't drift.
+            return max(self.when + self.interval, clock())
+
+        if self.cron is not None:
+            now = wall_clock()
+            return clock() + self.cron.next_after(now) - now
+
+        return None
+
+
+class Scheduler:
+    """
+    Timers for the synchronous IRCBot, kept in a heap ordered by
+    deadline. The bot asks next_delay() how long it may wait for input,
+    and calls run_due() to run the jobs whose time has come. If a job
+    raises an exception, on_error(job, exception) is called, if given;
+    otherwise the exception propagates.
+    """
+    def __init__(self, clock=time.monotonic, wall_clock=time.time,
+                 on_error=None):
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.on_error = on_error
+        self.heap = []
+        self.counter = itertools.count()
+
+    def schedule(self, job, when):
+        job.when = when
+        heapq.heappush(self.heap, (when, next(self.counter), job))
+        return job
+
+    def call_at(self, when, func, *args):
+        """
+        Call func(*args) when the scheduler's clock reaches when.
+        """
+        return self.schedule(Job(func, args), when)
+
+    def call_later(self, delay, func, *args):
+        """
+        Call func(*args) in delay seconds.
+        """
+        return self.call_at(self.clock() + delay, func, *args)
+
+    def call_every(self, interval, func, *args):
+        """
+        Call func(*args) every interval seconds, the first time after
+        one interval.
+        """
+        return self.schedule(Job(func, args, interval=interval),
+                             self.clock() + interval)
+
+    def call_cron(self, spec, func, *args):
+        """
+        Call func(*args) at the times specified by the cron-like spec,
+        see CronSpec.
+        """
+        job = Job(func, args, cron=CronSpec(spec))
+        job.when = self.clock()
+        return self.schedule(job, job.next_when(self.clock,
+                                                self.wall_clock))
+
+    def next_delay(self):
+        """
+        Returns: the number of seconds until the next job is due, or
+        None if there are no jobs.
+        """
+        heap = self.heap
+
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+
+        if not heap:
+            return None
+
+        return max(0, heap[0][0] - self.clock())
+
+    def run_due(self):
+        """
+        Run all jobs which are due.
+
+        Returns: the number of jobs run.
+        """
+        heap = self.heap
+        now = self.clock()
+        count = 0
+
+        while heap and heap[0][0] <= now:
+            when, _, job = heapq.heappop(heap)
+
+            if job.cancelled:
+                continue
+
+            # Reschedule before running, so that an exception in the
+            # job doesn't stop it from repeating.
+            when = job.next_when(self.clock, self.wall_clock)
+
+            if when is not None:
+                self.schedule(job, when)
+
+            count += 1
+
+            try:
+                job.func(*job.args)
+            except Exception as e:
+                if self.on_error is None:
+                    raise
+                self.on_error(job, e)
+
+        return count
+
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import collections
+import time
+
+from botymcbotface.ratelimit import TokenBucket
+
+# Lines are sent in the order they were queued, except for urgent ones
+# (PING and PONG), which go ahead of the rest so that the server doesn't
+# think we're gone. Neither urgent nor control lines (JOIN, MODE, CAP...)
+# are ever dropped; normal lines (PRIVMSG and NOTICE) are shed when the
+# queue is overloaded. All of them are paced by the flood limit.
+URGENT = 0
+CONTROL = 1
+NORMAL = 2
+
+URGENT_COMMANDS = (b"PING", b"PONG")
+NORMAL_COMMANDS = (b"PRIVMSG", b"NOTICE")
+
+# Overload policies.
+DROP_OLDEST = "drop_oldest"
+REJECT = "reject"
+
+
+def line_priority(data):
+    """
+    Returns: NORMAL for PRIVMSG and NOTICE lines, URGENT for PING and
+    PONG lines, otherwise CONTROL.
+    """
+    command = data.split(b" ", 1)[0].upper()
+
+    if command in NORMAL_COMMANDS:
+        return NORMAL
+
+    if command in URGENT_COMMANDS:
+        return URGENT
+
+    return CONTROL
+
+
+class SendQueue:
+    """
+    Outbound lines (encoded, with CRLF) waiting to be written to the
+    server. Every line is paced by a token bucket, allowing bursts of
+    `burst` lines and then `rate` lines per second; while the connection
+    is lagging (see `slow`), the rate is multiplied by `lag_factor`.
+
+    When the queue holds `high_water` bytes or more it's overloaded,
+    until it's down to `low_water` bytes again. on_overload() and
+    on_resume() are called when that changes, so handlers can shed
+    load. While overloaded, the policy decides what happens to new
+    normal lines: DROP_OLDEST drops the oldest queued normal lines, down
+    to low_water, to make room; REJECT refuses the new ones. If coalesce
+    is set, a normal line identical to one already in the queue is not
+    queued again while overloaded.
+
+    Urgent and control lines are always accepted and never dropped, so
+    they aren't bounded by the queue; they count toward the watermarks,
+    though, so normal lines make room for them.
+    """
+    def __init__(self, high_water=64 * 1024, low_water=16 * 1024,
+                 policy=DROP_OLDEST, coalesce=True, burst=5, rate=1.0,
+                 lag_factor=0.25, on_overload=None, on_resume=None,
+                 clock=time.monotonic):
+        if policy not in (DROP_OLDEST, REJECT):
+            raise ValueError("Unknown overload policy: %r" % policy)
+
+        self.high_water = high_water
+        self.low_water = low_water
+        self.policy = policy
+        self.coalesce = coalesce
+        self.rate = rate
+        self.lag_factor = lag_factor
+        self.on_overload = on_overload
+        self.on_resume = on_resume
+        self.clock = clock
+        self.bucket = TokenBucket(burst, rate, clock())
+        self.slow = False
+        # Urgent lines, and (priority, line) for the rest, in order.
+        self.urgent = collections.deque()
+        self.lines = collections.deque()
+        self.queued = collections.Counter()
+        self.normal_lines = 0
+        self.size = 0
+        self.overloaded = False
+        self.dropped = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.urgent) + len(self.lines)
+
+    def put(self, data, priority=None):
+        """
+        Queue an encoded line. priority is URGENT, CONTROL or NORMAL; by
+        default it's decided by the line's command.
+
+        Returns: False if the line was rejected, otherwise True.
+        """
+        if priority is None:
+            priority = line_priority(data)
+
+        if priority == URGENT:
+            self.urgent.append(data)
+            self.size += len(data)
+            self.check_water()
+            return True
+
+        if priority == NORMAL and self.overloaded:
+            if self.coalesce and data in self.queued:
+                self.coalesced += 1
+                return True
+
+            if self.policy == REJECT:
+                self.rejected += 1
+                return False
+
+        self.lines.append((priority, data))
+        self.size += len(data)
+
+        if priority == NORMAL:
+            self.queued[data] += 1
+            self.normal_lines += 1
+
+        self.check_water()
+
+        if self.overloaded and self.policy == DROP_OLDEST:
+            self.shed()
+
+        return True
+
+    def shed(self):
+        """
+        Drop the oldest normal lines, but never the newest one, until
+        the queue is down to low_water. We stay overloaded until pop()
+        finds the queue there, so on_resume() isn't called from here.
+        """
+        lines = self.lines
+        # Control lines in the way, put back in order afterwards.
+        kept = []
+
+        while lines and self.must_shed():
+            entry = lines.popleft()
+            if entry[0] == NORMAL:
+                self.drop(entry[1])
+            else:
+                kept.append(entry)
+
+        lines.extendleft(reversed(kept))
+
+    def must_shed(self):
+        return self.size > self.low_water and self.normal_lines > 1
+
+    def drop(self, data):
+        self.forget(data)
+        self.dropped += 1
+
+    def forget(self, data):
+        self.size -= len(data)
+        self.normal_lines -= 1
+        self.queued[data] -= 1
+
+        if not self.queued[data]:
+            del self.queued[data]
+
+    def check_water(self):
+        if not self.overloaded and self.size >= self.high_water:
+            self.overloaded = True
+            if self.on_overload:
+                self.on_overload()
+        elif self.overloaded and self.size <= self.low_water:
+            self.overloaded = False
+            if self.on_resume:
+                self.on_resume()
+
+    def update_rate(self):
+        self.bucket.rate = self.rate * (self.lag_factor if self.slow else 1)
+
+    def pop(self):
+        """
+        Returns: the next line which may be written now, or None if
+        there is none (see delay()).
+        """
+        if not self.urgent and not self.lines:
+            return None
+
+        self.update_rate()
+
+        if not self.bucket.consume(self.clock()):
+            return None
+
+        if self.urgent:
+            data = self.urgent.popleft()
+            self.size -= len(data)
+        else:
+            priority, data = self.lines.popleft()
+            if priority == NORMAL:
+                self.forget(data)
+            else:
+                self.size -= len(data)
+
+        self.check_water()
+        return data
+
+    def delay(self):
+        """
+        Returns: the number of seconds until pop() will return a line,
+        or None if the queue is empty.
+        """
+        if not self.urgent and not self.lines:
+            return None
+
+        self.update_rate()
+        return self.bucket.delay(self.clock())
+
+    def clear(self):
+        """
+        Forget everything in the queue, such as when the connection is
+        lost.
+        """
+        self.urgent.clear()
+        self.lines.clear()
+        self.queued.clear()
+        self.normal_lines = 0
+        self.size = 0
+        self.check_water()
+
+    def stats(self):
+        return {
+            "lines": len(self),
+            "bytes": self.size,
+            "overloaded": self.overloaded,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+        }
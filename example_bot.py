@@ -2,6 +2,9 @@
 # -*- encoding: utf-8 -*-
 
 import os
+import time
+
+import botymcbotface.cache
 import botymcbotface.irc
 
 # The server to connect to.
@@ -52,30 +55,45 @@ bot.connect(server, main_channel)
 # Join additional channels:
 bot.join_channel("#bots")
 
+
+# If we want to do something periodically, we ask the bot to call a
+# function for us on a timer, rather than waking up every few seconds
+# to check. This one just prints the time once an hour. There's also
+# bot.call_later(), for doing something once, and bot.call_cron(), for
+# cron-like schedules such as "0 9 * * 1-5" (9:00 every weekday).
+def hourly():
+    print("Another hour has passed: %s" % time.ctime())
+
+
+bot.call_every(3600, hourly)
+
+
+# If a command always gives the same reply to the same question, and
+# working out the reply takes some effort (looking something up on the
+# web, for example), the bot can remember its replies for a while.
+# Decorate the function with cached_command(); ttl is how many seconds
+# a reply is remembered for. The first argument must be the bot, since
+# each bot has its own cache.
+@botymcbotface.cache.cached_command(ttl=600)
+def help_text(bot, msg):
+    return "I'm a bot skeleton. All I know is !help."
+
+
 # MAIN LOOP
 # =========
 
 while True:
 
-    # Get one message from the IRC server. The '5' is a timeout; If
-    # nothing happens on the server in 5 seconds, the get_msg()
-    # function will return None, giving us a chance to do stuff here
-    # periodically. Otherwise, we'd be stuck waiting for messages
-    # forever if there are none. This way, we can do something else
-    # every 5 seconds or so if we want.
-    msg = bot.get_msg(5)
-
-    # If we reached a timeout before getting a message, then no IRCMsg
-    # will have been returned (we will have gotten None instead). In
-    # that case, just loop round (back up to "while True") to wait
-    # another 5 seconds.
-    #
-    # If we wanted to do something in the background every 5 (or
-    # every X) seconds, this is where we'd do it, right before the
-    # continue statement.
-    #
-    # Now we check if we got a message from get_msg, or if it simply
-    # timed out:
+    # Get one message from the IRC server. The argument is a timeout;
+    # None means that we wait for as long as it takes. While waiting,
+    # the bot runs the jobs we scheduled with call_every() above, right
+    # when they are due.
+    msg = bot.get_msg(None)
+
+    # Some lines from the server (such as PINGs, which the bot answers
+    # by itself) don't result in an IRCMsg (we will have gotten None
+    # instead). In that case, just loop round (back up to "while
+    # True") to wait for the next one:
     if not msg:
         continue
 
@@ -114,6 +132,10 @@ while True:
         print("Channel message: %s @ %s: %s" % (msg.sender, msg.channel,
                                                 msg.msg_text))
 
+        # Answer "!help", from the cache if we can.
+        if msg.msg_text.split()[:1] == ["!help"]:
+            bot.privmsg(msg.channel, help_text(bot, msg))
+
     # If we get a message of type JOIN, that means that the 'sender'
     # joined the channel specified in 'channel'. So let's send this
     # user a greeting! But we only want to do that in our own
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from botymcbotface.flood import InboundThrottle
+from botymcbotface.irc import IRCBot
+from botymcbotface.ratelimit import SlidingWindowCounter
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def privmsg(nick, target="#chan", text="spam"):
+    return ":%s!user@host PRIVMSG %s :%s" % (nick, target, text)
+
+
+class SpamBot(IRCBot):
+    """
+    A bot which reads its lines from a list instead of a server, and
+    counts the messages which reach its handlers.
+    """
+    def __init__(self, lines, clock):
+        super().__init__("bot", "secret")
+        self.throttle = InboundThrottle(clock=clock)
+        self.feed = iter(lines)
+        self.channel_msgs = 0
+
+    def get_line(self, timeout=10):
+        return next(self.feed, None)
+
+    def on_channel_msg(self, msg):
+        self.channel_msgs += 1
+
+
+class InboundThrottleTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.throttle = InboundThrottle(nick_limit=3, nick_window=10,
+                                        channel_limit=5, channel_window=10,
+                                        cooldown=60, clock=self.clock)
+
+    def test_spam_load(self):
+        # 100k lines in one window, from a few nicks: only the first
+        # nick_limit lines from each get through.
+        lines = [privmsg("nick%d" % (i % 5)) for i in range(100000)]
+        bot = SpamBot(lines, FakeClock())
+
+        for _ in lines:
+            bot.route_msg()
+
+        self.assertEqual(bot.channel_msgs, 5 * bot.throttle.nick_limit)
+        self.assertEqual(bot.throttle.dropped,
+                         len(lines) - 5 * bot.throttle.nick_limit)
+
+    def test_command_spam_load(self):
+        # 100k commands in one window, from many nicks: only the first
+        # channel_limit of them get through.
+        lines = [privmsg("nick%d" % (i % 50), text="!help")
+                 for i in range(100000)]
+        bot = SpamBot(lines, FakeClock())
+
+        for _ in lines:
+            bot.route_msg()
+
+        self.assertEqual(bot.channel_msgs, bot.throttle.channel_limit)
+
+    def test_busy_channel(self):
+        # Ordinary chat, 4 lines a second from 40 nicks, none of them
+        # over the nick limit, isn't throttled, and neither is a
+        # command in the middle of it.
+        clock = FakeClock()
+        throttle = InboundThrottle(clock=clock)
+
+        for i in range(400):
+            clock.now += 0.25
+            self.assertTrue(throttle.allow_line(privmsg("nick%d" % (i % 40),
+                                                        text="chat")))
+
+        self.assertTrue(throttle.allow_line(privmsg("op", text="!help")))
+        self.assertEqual(throttle.dropped, 0)
+
+    def test_nick_cooldown(self):
+        for _ in range(3):
+            self.assertTrue(self.throttle.allow_line(privmsg("spammer",
+                                                             "bot")))
+
+        self.assertFalse(self.throttle.allow_line(privmsg("spammer", "bot")))
+        self.assertIn("spammer", self.throttle.ignored)
+
+        # Still ignored just before the cooldown ends...
+        self.clock.now += 59
+        self.assertFalse(self.throttle.allow_line(privmsg("spammer", "bot")))
+
+        # ...and not after.
+        self.clock.now += 1
+        self.assertTrue(self.throttle.allow_line(privmsg("spammer", "bot")))
+        self.assertNotIn("spammer", self.throttle.ignored)
+
+    def test_channel_cooldown(self):
+        def command(nick, target="#chan"):
+            return privmsg(nick, target, "!help")
+
+        for i in range(5):
+            self.assertTrue(self.throttle.allow_line(command("nick%d" % i)))
+
+        self.assertFalse(self.throttle.allow_line(command("other")))
+        self.assertFalse(self.throttle.allow_line(command("other", "#CHAN")))
+        self.assertTrue(self.throttle.allow_line(command("other", "#else")))
+
+        # Only commands are dropped during the cooldown.
+        self.assertTrue(self.throttle.allow_line(privmsg("other")))
+
+        self.clock.now += 60
+        self.assertTrue(self.throttle.allow_line(command("other")))
+
+    def test_window_slides(self):
+        for _ in range(3):
+            self.assertTrue(self.throttle.allow_line(privmsg("nick")))
+
+        # Two windows later, the old messages no longer count.
+        self.clock.now += 20
+        for _ in range(3):
+            self.assertTrue(self.throttle.allow_line(privmsg("nick")))
+
+    def test_ignored_nick_can_join_and_part(self):
+        self.throttle.ignore("Spammer")
+
+        self.assertFalse(self.throttle.allow_line(privmsg("spammer")))
+        self.assertTrue(self.throttle.allow_line(
+            ":spammer!user@host JOIN #chan"))
+        self.assertTrue(self.throttle.allow_line(
+            ":spammer!user@host PART #chan"))
+        self.assertTrue(self.throttle.allow_line(
+            ":spammer!user@host QUIT :bye"))
+
+    def test_unignore(self):
+        self.throttle.ignore("spammer", 3600)
+        self.throttle.unignore("SPAMMER")
+
+        self.assertTrue(self.throttle.allow_line(privmsg("spammer")))
+
+    def test_server_lines_get_through(self):
+        self.throttle.ignore("irc.example.org")
+
+        self.assertTrue(self.throttle.allow_line("PING :irc.example.org"))
+        self.assertTrue(self.throttle.allow_line(
+            ":irc.example.org NOTICE * :Looking up your hostname"))
+
+    def test_ignored_is_bounded(self):
+        throttle = InboundThrottle(max_ignored=100, clock=self.clock)
+
+        for i in range(1000):
+            throttle.ignore("nick%d" % i, 3600)
+
+        self.assertEqual(len(throttle.ignored), 100)
+        self.assertIn("nick999", throttle.ignored)
+        self.assertNotIn("nick0", throttle.ignored)
+
+
+class SlidingWindowCounterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_estimate(self):
+        counter = SlidingWindowCounter(10, clock=self.clock)
+
+        for _ in range(10):
+            counter.hit("key")
+
+        # Half of the previous window still overlaps.
+        self.clock.now += 15
+        self.assertEqual(counter.hit("key"), 10 * 0.5 + 1)
+
+    def test_quiet_keys_expire(self):
+        counter = SlidingWindowCounter(10, clock=self.clock)
+
+        for i in range(100):
+            counter.hit("nick%d" % i)
+
+        self.clock.now += 20
+        counter.hit("new")
+
+        self.assertEqual(list(counter.counters), ["new"])
+
+    def test_many_distinct_keys(self):
+        counter = SlidingWindowCounter(10, max_keys=100, clock=self.clock)
+
+        for i in range(10000):
+            self.assertEqual(counter.hit("nick%d" % i), 1)
+
+        self.assertEqual(len(counter.counters), 100)
+        self.assertIn("nick9999", counter.counters)
+
+    def test_recently_used_keys_are_kept(self):
+        counter = SlidingWindowCounter(10, max_keys=3, clock=self.clock)
+
+        counter.hit("a")
+        counter.hit("b")
+        counter.hit("c")
+        counter.hit("a")
+        counter.hit("d")
+
+        self.assertEqual(list(counter.counters), ["c", "a", "d"])
+
+
+if __name__ == "__main__":
+    unittest.main()